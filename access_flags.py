@@ -13,6 +13,7 @@ method_access_flags = [
     ('ACC_PUBLIC',       0x0001),
     ('ACC_PRIVATE',      0x0002),
     ('ACC_PROTECTED',    0x0004),
+    ('ACC_STATIC',       0x0008),
     ('ACC_FINAL',        0x0010),
     ('ACC_SYNCHRONIZED', 0x0020),
     ('ACC_BRIDGE',       0x0040),
@@ -27,6 +28,7 @@ field_access_flags = [
     ('ACC_PUBLIC',       0x0001),
     ('ACC_PRIVATE',      0x0002),
     ('ACC_PROTECTED',    0x0004),
+    ('ACC_STATIC',       0x0008),
     ('ACC_FINAL',        0x0010),
     ('ACC_VOLATILE',     0x0040),
     ('ACC_TRANSIENT',    0x0080),
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import zipfile
+
+MANIFEST = 'manifest.json'
+
+# Stand-ins for the class's own package inside a stored body, '\0' never shows up in decompiled text
+# unless a string constant contains it, in which case the body is stored as is.
+PACKAGE_MARKER = '\0P'
+
+def split_source(lines: [str]) -> (str, str):
+    # Splits decompile_class() output after the class declaration: the header carries the package,
+    # imports and class name, the body is what relocated copies of a class have in common.
+    for i, line in enumerate(lines):
+        if line.endswith(' {'):
+            return '\n'.join(lines[:i + 1]), '\n'.join(lines[i + 1:]) + '\n'
+    return '\n'.join(lines), ''
+
+def normalize_body(body: str, package: str) -> (str, bool):
+    if not package or PACKAGE_MARKER in body:
+        return body, False
+    body = body.replace(package + '/', PACKAGE_MARKER + '/')
+    body = body.replace(package.replace('/', '.') + '.', PACKAGE_MARKER + '.')
+    return body, True
+
+def restore_body(body: str, package: str) -> str:
+    body = body.replace(PACKAGE_MARKER + '/', package + '/')
+    return body.replace(PACKAGE_MARKER + '.', package.replace('/', '.') + '.')
+
+class SourceArchive():
+    # Writes decompiled sources into a single zip. Bodies are stored once under objects/<sha256>.java
+    # with references to the class's own package normalised, so shaded / relocated copies of a class
+    # share one object. manifest.json keeps the header of every source path next to its body hash.
+    def __init__(self, file_path, compression=zipfile.ZIP_DEFLATED, compresslevel=6):
+        self.file_path = file_path
+        self.archive = zipfile.ZipFile(file_path, 'w', compression=compression, compresslevel=compresslevel)
+        self.manifest = {}
+        self.stored = set()
+        # UTF-8 bytes before compression: every source as read_archive() returns it, and what is
+        # actually kept for them (each header plus each unique body).
+        self.bytes_in = 0
+        self.bytes_stored = 0
+        self.sizes = {}
+
+    def add(self, path: str, header: str, body: str, package='') -> str:
+        normalized_body, normalized = normalize_body(body, package)
+        data = normalized_body.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        # Counted with the newline read_archive() joins header and body with.
+        header_size = len(header.encode('utf-8')) + 1
+
+        self.manifest[path] = {
+            'header': header,
+            'package': package if normalized else None,
+            'body': digest
+        }
+        source_size = header_size + len(body.encode('utf-8'))
+
+        # A path added twice only keeps its last source.
+        previous_source_size, previous_header_size = self.sizes.get(path, (0, 0))
+        self.sizes[path] = (source_size, header_size)
+        self.bytes_in += source_size - previous_source_size
+        self.bytes_stored += header_size - previous_header_size
+
+        if digest not in self.stored:
+            self.stored.add(digest)
+            self.bytes_stored += len(data)
+            self.archive.writestr(f"objects/{digest}.java", data)
+
+        return digest
+
+    def close(self):
+        self.archive.writestr(MANIFEST, json.dumps(self.manifest, indent=1, sort_keys=True))
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def read_archive(file_path) -> dict:
+    # Returns {path: source} for every source in an archive written by SourceArchive.
+    with zipfile.ZipFile(file_path) as archive:
+        manifest = json.loads(archive.read(MANIFEST))
+        bodies = {}
+        sources = {}
+
+        for path, entry in manifest.items():
+            digest = entry['body']
+            if digest not in bodies:
+                bodies[digest] = archive.read(f"objects/{digest}.java").decode('utf-8')
+
+            body = bodies[digest]
+            if entry['package'] is not None:
+                body = restore_body(body, entry['package'])
+
+            sources[path] = entry['header'] + '\n' + body
+
+        return sources
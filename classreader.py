@@ -2,10 +2,38 @@ import access_flags
 import opcodes
 import io
 import re
-
-def parse_u1(f): return int.from_bytes(f.read(1), 'big')
-def parse_u2(f): return int.from_bytes(f.read(2), 'big')
-def parse_u4(f): return int.from_bytes(f.read(4), 'big')
+import struct
+
+class ClassFormatError(Exception):
+    pass
+
+u1 = struct.Struct('>B')
+u2 = struct.Struct('>H')
+u4 = struct.Struct('>I')
+
+# A short read makes unpack raise struct.error, the entry points (ClassReader.read, read_class_name,
+# parse_code_info) turn that into a ClassFormatError with truncated() so single reads stay unchecked.
+def parse_u1(f): return u1.unpack(f.read(1))[0]
+def parse_u2(f): return u2.unpack(f.read(2))[0]
+def parse_u4(f): return u4.unpack(f.read(4))[0]
+
+def read_bytes(f, length):
+    # For variable length data, checked once per constant / attribute.
+    data = f.read(length)
+    if len(data) != length:
+        raise ClassFormatError(f"Unexpected end of data, wanted {length} bytes at offset {f.tell() - len(data)} but got {len(data)}")
+    return data
+
+def truncated(f, error: Exception) -> ClassFormatError:
+    return ClassFormatError(f"Unexpected end of data at offset {f.tell()}: {error}")
+
+def failure(stage: str, error: Exception, class_name=None, method=None) -> dict:
+    return {
+        'stage': stage,
+        'class': class_name,
+        'method': method,
+        'error': f"{type(error).__name__}: {error}"
+    }
 
 def parse_flags(value: int, flags: [(str, int)]) -> [str]:
     return [name for (name, mask) in flags if (value & mask) != 0]
@@ -16,38 +44,89 @@ def parse_field_descriptor(desc: str) -> str:
     else:
         return desc[1:][:-1]
 
+# tag -> (name, layout, field names, pool slots)
+# CONSTANT_Utf8 is variable length and handled separately, Long and Double take up two slots.
+constant_pool_layouts = {
+    opcodes.CONSTANT_Class:              ('CONSTANT_Class',              struct.Struct('>H'),  ('name_index',), 1),
+    opcodes.CONSTANT_Fieldref:           ('CONSTANT_Fieldref',           struct.Struct('>HH'), ('class_index', 'name_and_type_index'), 1),
+    opcodes.CONSTANT_Methodref:          ('CONSTANT_Methodref',          struct.Struct('>HH'), ('class_index', 'name_and_type_index'), 1),
+    opcodes.CONSTANT_InterfaceMethodRef: ('CONSTANT_InterfaceMethodRef', struct.Struct('>HH'), ('class_index', 'name_and_type_index'), 1),
+    opcodes.CONSTANT_String:             ('CONSTANT_String',             struct.Struct('>H'),  ('string_index',), 1),
+    opcodes.CONSTANT_Integer:            ('CONSTANT_Integer',            struct.Struct('>i'),  ('bytes',), 1),
+    opcodes.CONSTANT_Float:              ('CONSTANT_Float',              struct.Struct('>f'),  ('bytes',), 1),
+    opcodes.CONSTANT_Long:               ('CONSTANT_Long',               struct.Struct('>q'),  ('bytes',), 2),
+    opcodes.CONSTANT_Double:             ('CONSTANT_Double',             struct.Struct('>d'),  ('bytes',), 2),
+    opcodes.CONSTANT_NameAndType:        ('CONSTANT_NameAndType',        struct.Struct('>HH'), ('name_index', 'descriptor_index'), 1),
+    opcodes.CONSTANT_MethodHandle:       ('CONSTANT_MethodHandle',       struct.Struct('>BH'), ('reference_kind', 'reference_index'), 1),
+    opcodes.CONSTANT_MethodType:         ('CONSTANT_MethodType',         struct.Struct('>H'),  ('descriptor_index',), 1),
+    opcodes.CONSTANT_Dynamic:            ('CONSTANT_Dynamic',            struct.Struct('>HH'), ('bootstrap_method_attr_index', 'name_and_type_index'), 1),
+    opcodes.CONSTANT_InvokeDynamic:      ('CONSTANT_InvokeDynamic',      struct.Struct('>HH'), ('bootstrap_method_attr_index', 'name_and_type_index'), 1),
+    opcodes.CONSTANT_Module:             ('CONSTANT_Module',             struct.Struct('>H'),  ('name_index',), 1),
+    opcodes.CONSTANT_Package:            ('CONSTANT_Package',            struct.Struct('>H'),  ('name_index',), 1),
+}
+
+def parse_constant_pool(f, size):
+    # Entries are stored at index - 1, the slot following a Long or Double is filled
+    # with a CONSTANT_Unusable placeholder so every later index stays where the class file expects it.
+    constant_pool = []
+    while len(constant_pool) < size - 1:
+        tag = f.read(1)[0]
+
+        if tag == opcodes.CONSTANT_Utf8:
+            length = parse_u2(f)
+            constant_pool.append({'tag': 'CONSTANT_Utf8', 'bytes': read_bytes(f, length)})
+            continue
+
+        layout = constant_pool_layouts.get(tag)
+        if layout is None:
+            # Constants carry no length, so there is no way to resynchronize past an unknown tag.
+            raise ClassFormatError(f"Unexpected tag {tag} for constant {len(constant_pool) + 1}")
+
+        name, fmt, keys, slots = layout
+        cp_info = {'tag': name}
+        cp_info.update(zip(keys, fmt.unpack(f.read(fmt.size))))
+        constant_pool.append(cp_info)
+
+        if slots == 2:
+            constant_pool.append({'tag': 'CONSTANT_Unusable'})
+
+    return constant_pool
+
 def parse_attributes(f, count):
     attributes = []
     for i in range(count):
         attribute = {}
         attribute['attribute_name_index'] = parse_u2(f)
         attribute_length = parse_u4(f)
-        attribute['info'] = f.read(attribute_length)
+        attribute['info'] = read_bytes(f, attribute_length)
         attributes.append(attribute)
     return attributes
 
 def parse_code_info(info: bytes) -> dict:
     code = {}
     with io.BytesIO(info) as f:
-        code['max_stack'] = parse_u2(f)
-        code['max_locals'] = parse_u2(f)
-        code_length = parse_u4(f)
-        code['code'] = f.read(code_length)
-        exception_table_length = parse_u2(f)
-        exceptions = []
-
-        for i in range(exception_table_length):
-            exception = {}
-            exception['start_pc'] = parse_u2(f)
-            exception['end_pc'] = parse_u2(f)
-            exception['handler_pc'] = parse_u2(f)
-            exception['catch_type'] = parse_u2(f)
-            exceptions.append(exception)
+        try:
+            code['max_stack'] = parse_u2(f)
+            code['max_locals'] = parse_u2(f)
+            code_length = parse_u4(f)
+            code['code'] = read_bytes(f, code_length)
+            exception_table_length = parse_u2(f)
+            exceptions = []
+
+            for i in range(exception_table_length):
+                exception = {}
+                exception['start_pc'] = parse_u2(f)
+                exception['end_pc'] = parse_u2(f)
+                exception['handler_pc'] = parse_u2(f)
+                exception['catch_type'] = parse_u2(f)
+                exceptions.append(exception)
         
-        code['exception_table'] = exceptions
+            code['exception_table'] = exceptions
         
-        attributes_count = parse_u2(f)
-        code['attributes'] = parse_attributes(f, attributes_count)
+            attributes_count = parse_u2(f)
+            code['attributes'] = parse_attributes(f, attributes_count)
+        except struct.error as e:
+            raise truncated(f, e)
 
     return code
     
@@ -131,6 +210,24 @@ def parse_field_descriptor(desc: str) -> str:
     args = desc.strip("L")[:-1] if desc.startswith("L") else translate(desc)
     return args
     
+def read_class_name(class_bytes: bytes) -> str:
+    # Reads only up to this_class, enough to key a class by its internal name without a full parse.
+    with io.BytesIO(class_bytes) as f:
+        try:
+            magic = parse_u4(f)
+            if magic != 0xCAFEBABE:
+                raise ClassFormatError(f"Bad magic {hex(magic)[2:].upper()}")
+
+            parse_u2(f)
+            parse_u2(f)
+            constant_pool = parse_constant_pool(f, parse_u2(f))
+            parse_u2(f)
+            this_class = parse_u2(f)
+        except (struct.error, IndexError) as e:
+            raise truncated(f, e)
+
+    return constant_pool[constant_pool[this_class - 1]['name_index'] - 1]['bytes'].decode('utf-8')
+
 class ClassReader():
     def __init__(self, class_bytes):
         self.class_bytes = class_bytes
@@ -138,126 +235,79 @@ class ClassReader():
     def read(self) -> dict:
         clazz = {}
         with io.BytesIO(self.class_bytes) as f:
-            clazz['magic'] = hex(parse_u4(f))[2:].upper()
-            clazz['minor'] = parse_u2(f)
-            clazz['major'] = parse_u2(f)
+            try:
+                clazz['magic'] = hex(parse_u4(f))[2:].upper()
+                if clazz['magic'] != 'CAFEBABE':
+                    raise ClassFormatError(f"Bad magic {clazz['magic']}")
 
-            constant_pool_size = parse_u2(f)
-            constant_pool = []
+                clazz['minor'] = parse_u2(f)
+                clazz['major'] = parse_u2(f)
 
-            for i in range(constant_pool_size-1):
-                cp_info = {}
-                tag = parse_u1(f)
-        
-                if tag == opcodes.CONSTANT_Methodref:
-                    cp_info['tag'] = 'CONSTANT_Methodref'
-                    cp_info['class_index'] = parse_u2(f)
-                    cp_info['name_and_type_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_InterfaceMethodRef:
-                    cp_info['tag'] = 'CONSTANT_InterfaceMethodRef'
-                    cp_info['class_index'] = parse_u2(f)
-                    cp_info['name_and_type_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_MethodType:
-                    cp_info['tag'] = 'CONSTANT_MethodType'
-                    cp_info['descriptor_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_MethodHandle:
-                    cp_info['tag'] = 'CONSTANT_MethodHandle'
-                    cp_info['reference_kind'] = parse_u1(f)
-                    cp_info['reference_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_InvokeDynamic:
-                    cp_info['tag'] = 'CONSTANT_InvokeDynamic'
-                    cp_info['bootstrap_method_attr_index'] = parse_u2(f)
-                    cp_info['name_and_type_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_Class:
-                    cp_info['tag'] = 'CONSTANT_Class'
-                    cp_info['name_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_NameAndType:
-                    cp_info['tag'] = 'CONSTANT_NameAndType'
-                    cp_info['name_index'] = parse_u2(f)
-                    cp_info['descriptor_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_Utf8:
-                    cp_info['tag'] = 'CONSTANT_Utf8'
-                    length = parse_u2(f)
-                    cp_info['bytes'] = f.read(length)
-                elif tag == opcodes.CONSTANT_Integer:
-                    cp_info['tag'] = 'CONSTANT_Integer'
-                    cp_info['bytes'] = parse_u4(f)
-                elif tag == opcodes.CONSTANT_Long:
-                    cp_info['tag'] = 'CONSTANT_Long'
-                    cp_info['bytes'] = parse_u4(f)
-                elif tag == opcodes.CONSTANT_Fieldref:
-                    cp_info['tag'] = 'CONSTANT_Fieldref'
-                    cp_info['class_index'] = parse_u2(f)
-                    cp_info['name_and_type_index'] = parse_u2(f)
-                elif tag == opcodes.CONSTANT_String:
-                    cp_info['tag'] = 'CONSTANT_String'
-                    cp_info['string_index'] = parse_u2(f)
-                elif tag == 0:
-                    cp_info['tag'] = 'CONSTANT_Utf8'
-                    cp_info['bytes'] = f.read(3)
-                else:
-                    f.read(0)
-                    assert False, f"Unexpected tag {tag}"
-    
-                constant_pool.append(cp_info)
+                constant_pool_size = parse_u2(f)
+                constant_pool = parse_constant_pool(f, constant_pool_size)
 
-            clazz['constant_pool'] = constant_pool
-            clazz['access_flags'] = parse_flags(parse_u2(f), access_flags.class_access_flags)
-            clazz['this_class'] = parse_u2(f)
-            clazz['super_class'] = parse_u2(f)
+                clazz['constant_pool'] = constant_pool
+                clazz['access_flags'] = parse_flags(parse_u2(f), access_flags.class_access_flags)
+                clazz['this_class'] = parse_u2(f)
+                clazz['super_class'] = parse_u2(f)
             
-            # CLASS NAME -> pp.pprint(clazz['constant_pool'][clazz['constant_pool'][clazz['this_class'] - 1]['name_index'] -1])
-            # SUPER CLASS NAME -> pp.pprint(clazz['constant_pool'][clazz['constant_pool'][clazz['super_class'] - 1]['name_index'] -1])
+                # CLASS NAME -> pp.pprint(clazz['constant_pool'][clazz['constant_pool'][clazz['this_class'] - 1]['name_index'] -1])
+                # SUPER CLASS NAME -> pp.pprint(clazz['constant_pool'][clazz['constant_pool'][clazz['super_class'] - 1]['name_index'] -1])
 
-            interfaces_count = parse_u2(f)
-            interfaces = []
+                interfaces_count = parse_u2(f)
+                interfaces = []
 
-            for i in range(interfaces_count):
-                interfaces.append(parse_u2(f))
+                for i in range(interfaces_count):
+                    interfaces.append(parse_u2(f))
             
-            clazz['interfaces'] = interfaces
-
-            fields_count = parse_u2(f)
-            fields = []
-
-            for i in range(fields_count):
-                field = {}
-                field['access_flags'] = parse_flags(parse_u2(f), access_flags.field_access_flags)
-                field['name_index'] = parse_u2(f)
-                field['descriptor_index'] = parse_u2(f)
-                attributes_count = parse_u2(f)
-                field['attributes'] = parse_attributes(f, attributes_count)
-                fields.append(field)
+                clazz['interfaces'] = interfaces
+
+                fields_count = parse_u2(f)
+                fields = []
+
+                for i in range(fields_count):
+                    field = {}
+                    field['access_flags'] = parse_flags(parse_u2(f), access_flags.field_access_flags)
+                    field['name_index'] = parse_u2(f)
+                    field['descriptor_index'] = parse_u2(f)
+                    attributes_count = parse_u2(f)
+                    field['attributes'] = parse_attributes(f, attributes_count)
+                    fields.append(field)
                 
 
-            clazz['fields'] = fields
+                clazz['fields'] = fields
 
-            methods_count = parse_u2(f)
-            methods = []
+                methods_count = parse_u2(f)
+                methods = []
 
 
-            for i in range(methods_count):
-                method = {}
-                method['access_flags'] = parse_flags(parse_u2(f), access_flags.method_access_flags)
-                method['name_index'] = parse_u2(f)
-                method['descriptor_index'] = parse_u2(f)
+                for i in range(methods_count):
+                    method = {}
+                    method['access_flags'] = parse_flags(parse_u2(f), access_flags.method_access_flags)
+                    method['name_index'] = parse_u2(f)
+                    method['descriptor_index'] = parse_u2(f)
 
-                # METHOD NAME -> pp.pprint(clazz['constant_pool'][method['name_index'] -1])
-                # METHOD DESCRIPTOR -> pp.pprint(clazz['constant_pool'][method['descriptor_index'] -1])
+                    # METHOD NAME -> pp.pprint(clazz['constant_pool'][method['name_index'] -1])
+                    # METHOD DESCRIPTOR -> pp.pprint(clazz['constant_pool'][method['descriptor_index'] -1])
 
-                attributes_count = parse_u2(f)
+                    attributes_count = parse_u2(f)
 
-                method['attributes'] = parse_attributes(f, attributes_count)
-                methods.append(method)
+                    method['attributes'] = parse_attributes(f, attributes_count)
+                    methods.append(method)
 
-            clazz['methods'] = methods
+                clazz['methods'] = methods
 
-            attributes_count = parse_u2(f)
-            clazz['attributes'] = parse_attributes(f, attributes_count)
+                attributes_count = parse_u2(f)
+                clazz['attributes'] = parse_attributes(f, attributes_count)
+            except (struct.error, IndexError) as e:
+                raise truncated(f, e)
         
         return clazz
     
     def clean(self, clazz: dict) -> dict:
+        # Failures which only affect a single method are recorded in clazz['errors'] instead of raised.
+        clazz['errors'] = []
+
         class_name_index = clazz['this_class']
         clazz.pop('this_class')
         clazz['name'] = clazz['constant_pool'][clazz['constant_pool'][class_name_index - 1]['name_index'] -1]['bytes'].decode('utf-8')
@@ -343,6 +393,7 @@ class ClassReader():
             return_type = parse_field_descriptor(descriptor)
 
             field['desc'] = return_type
+            field['descriptor'] = descriptor
             field.pop('name_index')
             field.pop('descriptor_index')
 
@@ -365,6 +416,7 @@ class ClassReader():
             method['name'] = constant_pool[name_index - 1]['bytes'].decode('utf-8')
             args, return_type = parse_descriptor(descriptor)
             method['desc'] = (args, return_type)
+            method['descriptor'] = descriptor
 
             attributes = method['attributes']
 
@@ -374,7 +426,11 @@ class ClassReader():
                 attribute.pop('attribute_name_index')
 
                 if attribute['name'] == 'Code':
-                    attribute['info'] = parse_code_info(attribute['info'])
+                    # The attribute length already bounds the Code info, a broken one leaves the raw bytes in place.
+                    try:
+                        attribute['info'] = parse_code_info(attribute['info'])
+                    except ClassFormatError as e:
+                        clazz['errors'].append(failure('clean', e, clazz['name'], method['name'] + descriptor))
     
     
             method['attributes'] = attributes
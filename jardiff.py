@@ -0,0 +1,222 @@
+import classreader
+import hashlib
+import opcodes
+import os
+
+from classreader import ClassReader, failure
+from session import DecompilerSession
+
+def add_archive(session: DecompilerSession, path) -> [str]:
+    if os.path.isdir(path):
+        return session.add_directory(path)
+    return session.add_jar(path)
+
+def describe_constant(constant_pool: list, index: int) -> str:
+    # Renders a constant by value so the same constant at a different index compares equal.
+    if index == 0:
+        return ''
+
+    constant = constant_pool[index - 1]
+    tag = constant['tag']
+
+    if tag == 'CONSTANT_Utf8':
+        return constant['bytes'].decode('utf-8', 'replace')
+    elif tag in ('CONSTANT_Integer', 'CONSTANT_Float', 'CONSTANT_Long', 'CONSTANT_Double'):
+        return f"{tag}:{constant['bytes']!r}"
+
+    parts = [tag]
+    for key, value in constant.items():
+        if key.endswith('_index') and key != 'bootstrap_method_attr_index':
+            parts.append(describe_constant(constant_pool, value))
+        elif key != 'tag':
+            parts.append(str(value))
+    return ':'.join(parts)
+
+def hash_code(constant_pool: list, info: bytes) -> str:
+    # Hashes a Code attribute with every constant pool operand replaced by the constant it refers to,
+    # a recompile which only reshuffles the constant pool hashes the same. LineNumberTable and the
+    # other nested attributes are left out since they shift whenever code above the method changes.
+    # Looked up on the module so a profiling wrapper installed by main.py is used.
+    code_info = classreader.parse_code_info(info)
+    code = code_info['code']
+    digest = hashlib.sha256()
+    digest.update(code_info['max_stack'].to_bytes(2, 'big') + code_info['max_locals'].to_bytes(2, 'big'))
+
+    pc = 0
+    while pc < len(code):
+        opcode = code[pc]
+        start = pc
+        pc += 1
+
+        if opcode == opcodes.TABLESWITCH:
+            pc += -pc % 4
+            low = int.from_bytes(code[pc + 4:pc + 8], 'big', signed=True)
+            high = int.from_bytes(code[pc + 8:pc + 12], 'big', signed=True)
+            pc += 12 + (high - low + 1) * 4
+        elif opcode == opcodes.LOOKUPSWITCH:
+            pc += -pc % 4
+            npairs = int.from_bytes(code[pc + 4:pc + 8], 'big')
+            pc += 8 + npairs * 8
+        elif opcode == opcodes.WIDE:
+            pc += 5 if code[pc] == opcodes.IINC else 3
+        else:
+            pc += opcodes.operand_lengths.get(opcode, 0)
+
+        if opcode in opcodes.constant_pool_operands:
+            width = 1 if opcode == opcodes.LDC else 2
+            index = int.from_bytes(code[start + 1:start + 1 + width], 'big')
+            digest.update(bytes([opcode]))
+            digest.update(describe_constant(constant_pool, index).encode('utf-8') + b'\0')
+            digest.update(code[start + 1 + width:pc])
+        else:
+            digest.update(code[start:pc])
+
+    for exception in code_info['exception_table']:
+        digest.update(f"{exception['start_pc']}:{exception['end_pc']}:{exception['handler_pc']}:".encode('utf-8'))
+        digest.update(describe_constant(constant_pool, exception['catch_type']).encode('utf-8') + b'\0')
+
+    return digest.hexdigest()
+
+def skim_class(class_bytes: bytes) -> dict:
+    # Only ClassReader.read() and the names of members are resolved, Code is hashed instead of decompiled.
+    clazz = ClassReader(class_bytes).read()
+    constant_pool = clazz['constant_pool']
+
+    def utf8(index):
+        return constant_pool[index - 1]['bytes'].decode('utf-8')
+
+    def class_name(index):
+        return utf8(constant_pool[index - 1]['name_index']) if index != 0 else None
+
+    methods = {}
+    for method in clazz['methods']:
+        code_hash = None
+        for attribute in method['attributes']:
+            if utf8(attribute['attribute_name_index']) == 'Code':
+                code_hash = hash_code(constant_pool, attribute['info'])
+        methods[utf8(method['name_index']) + utf8(method['descriptor_index'])] = {
+            'access_flags': method['access_flags'],
+            'code_hash': code_hash
+        }
+
+    fields = {}
+    for field in clazz['fields']:
+        # ConstantValue is compared by value, a changed static final initializer is a change of the field.
+        constant = None
+        for attribute in field['attributes']:
+            if utf8(attribute['attribute_name_index']) == 'ConstantValue':
+                constant = describe_constant(constant_pool, int.from_bytes(attribute['info'][:2], 'big'))
+        fields[utf8(field['name_index']) + ':' + utf8(field['descriptor_index'])] = {
+            'access_flags': field['access_flags'],
+            'constant': constant
+        }
+
+    return {
+        'name': class_name(clazz['this_class']),
+        'super_name': class_name(clazz['super_class']),
+        'access_flags': clazz['access_flags'],
+        'interfaces': [class_name(index) for index in clazz['interfaces']],
+        'fields': fields,
+        'methods': methods
+    }
+
+def diff_members(old: dict, new: dict) -> dict:
+    added = [key for key in new if key not in old]
+    removed = [key for key in old if key not in new]
+    changed = [key for key in new if key in old and new[key] != old[key]]
+    return {'added': added, 'removed': removed, 'changed': changed}
+
+def decompile_method(session: DecompilerSession, class_name: str, method_key: str, decompile_code) -> str:
+    clazz = session.get_class(class_name)
+    for method in clazz['methods']:
+        if method['name'] + method['descriptor'] == method_key:
+            for attribute in method['attributes']:
+                if attribute['name'] == 'Code' and isinstance(attribute['info'], dict):
+                    return decompile_code(clazz, attribute['info']['code'])
+    return None
+
+def diff_class(class_name: str, old_bytes: bytes, new_bytes: bytes, old_session, new_session, decompile_code, errors: [dict]) -> dict:
+    old = skim_class(old_bytes)
+    new = skim_class(new_bytes)
+
+    changes = {}
+
+    for key in ('super_name', 'access_flags', 'interfaces'):
+        if old[key] != new[key]:
+            changes[key] = {'old': old[key], 'new': new[key]}
+
+    fields = diff_members(old['fields'], new['fields'])
+    if any(fields.values()):
+        fields['values'] = {key: {'old': old['fields'][key], 'new': new['fields'][key]} for key in fields['changed']}
+        changes['fields'] = fields
+
+    methods = diff_members(old['methods'], new['methods'])
+    if any(methods.values()):
+        changes['methods'] = methods
+
+        if decompile_code is not None:
+            sources = {}
+            for method_key in methods['changed']:
+                if old['methods'][method_key]['code_hash'] == new['methods'][method_key]['code_hash']:
+                    continue
+
+                try:
+                    sources[method_key] = {
+                        'old': decompile_method(old_session, class_name, method_key, decompile_code),
+                        'new': decompile_method(new_session, class_name, method_key, decompile_code)
+                    }
+                except Exception as e:
+                    errors.append(failure('decompile', e, class_name, method_key))
+
+            for method_key in methods['added']:
+                try:
+                    sources[method_key] = {'old': None, 'new': decompile_method(new_session, class_name, method_key, decompile_code)}
+                except Exception as e:
+                    errors.append(failure('decompile', e, class_name, method_key))
+
+            changes['sources'] = sources
+
+    return changes
+
+def diff_archives(old_path, new_path, decompile_code=None) -> dict:
+    # Matches classes by name and members by name + descriptor. Only methods whose Code hash
+    # differs are passed to decompile_code(clazz, code) for both versions. Classes whose bytes
+    # differ without any member-level change (constant pool order, debug info, other attributes)
+    # are listed under changed_bytes_only.
+    old_session = DecompilerSession()
+    new_session = DecompilerSession()
+
+    try:
+        old_names = add_archive(old_session, old_path)
+        new_names = add_archive(new_session, new_path)
+
+        result = {
+            'added_classes': sorted(set(new_names) - set(old_names)),
+            'removed_classes': sorted(set(old_names) - set(new_names)),
+            'changed_classes': {},
+            'changed_bytes_only': [],
+            'errors': []
+        }
+
+        for class_name in sorted(set(old_names) & set(new_names)):
+            old_bytes = old_session.read_source(class_name)
+            new_bytes = new_session.read_source(class_name)
+
+            if old_bytes == new_bytes:
+                continue
+
+            try:
+                changes = diff_class(class_name, old_bytes, new_bytes, old_session, new_session, decompile_code, result['errors'])
+            except Exception as e:
+                result['errors'].append(failure('skim', e, class_name))
+                continue
+
+            if changes:
+                result['changed_classes'][class_name] = changes
+            else:
+                result['changed_bytes_only'].append(class_name)
+    finally:
+        old_session.close()
+        new_session.close()
+
+    return result
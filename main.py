@@ -4,93 +4,243 @@ import opcodes
 import re
 import sys
 import argparse
-
-from classreader import ClassReader
+import os
+import json
+import classreader
+import multiprocessing
+import struct
+import math
+from multiprocessing import resource_tracker
+
+from classreader import ClassReader, failure, truncated, parse_u1, parse_u2, parse_u4
+from session import DecompilerSession, package_of
+from archive import SourceArchive, split_source
+from jardiff import diff_archives
+from memprofile import MemoryProfiler, print_report
+from sharedclass import attach_class, read_and_share
 
 pp = pprint.PrettyPrinter()
 
+float_layout = struct.Struct('>f')
+
 def find_methods_by_name(clazz: dict, name: str):
     return [method for method in clazz['methods'] if clazz['constant_pool'][method['name_index'] - 1]['bytes'].decode('utf-8') == name]
 
 def find_attributes_by_name(clazz: dict, attributes, name: str):
     return [attr for attr in attributes if clazz['constant_pool'][attr['attribute_name_index'] - 1]['bytes'].decode('utf-8') == name]
 
-def parse_u1(f): return int.from_bytes(f.read(1), 'big')
-def parse_u2(f): return int.from_bytes(f.read(2), 'big')
-def parse_u4(f): return int.from_bytes(f.read(4), 'big')
-
-def match_opcode(opcode, translations):
-    for instruction, code in translations:
-        if opcode == code:
-            return instruction
-    return opcode
-
-def execute_code(clazz: dict, code: bytes):
-    stack = []
+def resolve_class_name(session, package: str, class_name: str) -> str:
+    if session is None:
+        return class_name
+    return session.simple_name(class_name, package)
+
+def resolve_type(session, package: str, type: str) -> str:
+    # Declared types may be arrays, only the element type is simplified.
+    dimensions = ''
+    while type.endswith('[]'):
+        type, dimensions = type[:-2], dimensions + '[]'
+    return resolve_class_name(session, package, type) + dimensions
+
+def resolve_method_owner(session, package: str, methodref: dict) -> str:
+    class_name = methodref['class_name']
+    if session is not None:
+        class_name = session.resolve_method(class_name, methodref['method_name'], methodref['method_desc']) or class_name
+    return resolve_class_name(session, package, class_name)
+
+def resolve_field_owner(session, package: str, fieldref: dict) -> str:
+    class_name = fieldref['class_name']
+    if session is not None:
+        resolved = session.resolve_field(class_name, fieldref['field_name'])
+        if resolved is not None:
+            class_name = resolved[0]
+    return resolve_class_name(session, package, class_name)
+
+string_escapes = {'\b': '\\b', '\t': '\\t', '\n': '\\n', '\f': '\\f', '\r': '\\r', '"': '\\"', '\\': '\\\\'}
+
+def format_string_literal(value) -> str:
+    if isinstance(value, bytes):
+        # Modified UTF-8 which Python cannot decode (embedded NUL, surrogates), keep what can be read.
+        value = value.decode('utf-8', 'replace')
+
+    literal = ''
+    for char in value:
+        if char in string_escapes:
+            literal += string_escapes[char]
+        elif char < ' ' or char == '\x7f':
+            literal += f"\\u{ord(char):04x}"
+        else:
+            literal += char
+    return f'"{literal}"'
+
+def format_floating_literal(value: float, type: str) -> str:
+    # Java has no literal for NaN / Infinity, the constants of Float / Double are used instead.
+    if math.isnan(value):
+        return f"{type}.NaN"
+    elif math.isinf(value):
+        return f"{type}.{'POSITIVE' if value > 0 else 'NEGATIVE'}_INFINITY"
+
+    if type == 'Double':
+        literal = repr(value)
+    else:
+        # The shortest decimal which reads back as the same 32 bit float.
+        for precision in range(1, 10):
+            literal = f"{value:.{precision}g}"
+            try:
+                if float_layout.unpack(float_layout.pack(float(literal)))[0] == value:
+                    break
+            except OverflowError:
+                # Rounded up past Float.MAX_VALUE, needs more digits.
+                pass
+
+    if literal.lstrip('-').isdigit():
+        literal += '.0'
+    return literal + ('F' if type == 'Float' else '')
+
+def format_constant_value(clazz: dict, field: dict, info: bytes) -> str:
+    with io.BytesIO(info) as f:
+        constant = clazz['constant_pool'][parse_u2(f) - 1]
+
+    tag = constant['tag']
+
+    if tag == 'CONSTANT_Integer' and field['desc'] == 'boolean':
+        if constant['bytes'] == 0:
+            return 'false'
+        elif constant['bytes'] == 1:
+            return 'true'
+        else:
+            raise ValueError(f"Unexpected value for boolean: {constant['bytes']}")
+    elif tag == 'CONSTANT_Integer':
+        return str(constant['bytes'])
+    elif tag == 'CONSTANT_Long':
+        return f"{constant['bytes']}L"
+    elif tag == 'CONSTANT_Float':
+        return format_floating_literal(constant['bytes'], 'Float')
+    elif tag == 'CONSTANT_Double':
+        return format_floating_literal(constant['bytes'], 'Double')
+    elif tag == 'CONSTANT_String':
+        return format_string_literal(constant['value'])
+    else:
+        raise ValueError(f"Unsupported constant {tag} for field decompilation")
+
+def format_bytecode(code: bytes, reason: str) -> str:
+    # Fallback for methods which could not be decompiled, dumps the raw bytecode instead.
+    tab = '        '
+    body = f"{tab}// {reason}"
+    for i in range(0, len(code), 16):
+        body += f"\n{tab}// {i:04x}: {code[i:i + 16].hex(' ')}"
+    return body
+
+def decompile_code(clazz: dict, code: bytes, session=None, package='') -> str:
+    tab = '        '
+    body = ''
     with io.BytesIO(code) as f:
-        while f.tell() < len(code):
-            opcode = parse_u1(f)
-
-            if opcode == opcodes.GET_STATIC:
-                index = parse_u2(f)
-
-                fieldref = clazz['constant_pool'][index - 1]
-
-                class_name = fieldref['class_name']
-                field_name = fieldref['field_name']
-                field_desc = fieldref['field_desc']
-
-                stack.append({
-                    'type': field_desc[1:][:-1]
-                 })
-
-                print(f"GETSTATIC {class_name}.{field_name} {field_desc}")
-            elif opcode == opcodes.LDC:
-                index = parse_u1(f)
-
-                name = clazz['constant_pool'][clazz['constant_pool'][index - 1]['string_index'] - 1]['bytes'].decode('utf-8')
-
-                stack.append({
-                    'type': 'LDC', 'value': name
-                })
-
-                print(f"LDC \"{name}\"")
-            elif opcode == opcodes.INVOKE_VIRTUAL:
-                index = parse_u2(f)
-
-                methodref = clazz['constant_pool'][index - 1]
-                class_name = methodref['class_name']
-                method_name = methodref['method_name']
-                method_desc = methodref['method_desc']
-                
-                stack.append({ 'type': 'Invoke', 'method': method_name})
-
-                print(f"INVOKEVIRTUAL {class_name}.{method_name}{method_desc}")
-            elif opcode == opcodes.RETURN:
-                print("RETURN")
-            elif opcode == opcodes.BIPUSH:
-                byte = parse_u1(f)
-                print(f"BIPUSH {byte}")
-                stack.append({ 'type': 'Integer', 'value': byte })
-    print()
-    print("Stack:", stack)
-    print("Executed Code: ", end='')
-
-    for i, obj in enumerate(stack):
-        if obj['type'] == 'java/io/PrintStream':
-            provided_string = stack[i + 1]['value']
-            method = stack[i + 2]['method']
+        try:
+            while f.tell() < len(code):
+                opcode = parse_u1(f)
+
+
+                if opcode == opcodes.GET_STATIC:
+                    index = parse_u2(f)
+
+                    fieldref = clazz['constant_pool'][index - 1]
+
+                    class_name = resolve_field_owner(session, package, fieldref)
+                    field_name = fieldref['field_name']
+                    field_desc = fieldref['field_desc']
+
+
+
+                    body += f"{tab}GETSTATIC {class_name}.{field_name} // RETURN: {field_desc}"
+                elif opcode == opcodes.LDC:
+                    index = parse_u1(f)
+
+                    name = clazz['constant_pool'][index - 1]['value']
+
+                    body += f"{tab}LDC {format_string_literal(name)}"
+                elif opcode == opcodes.INVOKE_VIRTUAL:
+                    index = parse_u2(f)
+
+                    methodref = clazz['constant_pool'][index - 1]
+                    class_name = resolve_method_owner(session, package, methodref)
+                    method_name = methodref['method_name']
+                    method_desc = methodref['method_desc']
+
+                    body += f"{tab}INVOKEVIRTUAL {class_name}.{method_name}{method_desc}"
+                elif opcode == opcodes.INVOKE_SPECIAL:
+                    index = parse_u2(f)
+
+                    methodref = clazz['constant_pool'][index - 1]
+                    class_name = resolve_method_owner(session, package, methodref)
+                    method_name = methodref['method_name']
+                    method_desc = methodref['method_desc']
+
+                    body += f"{tab}INVOKESPECIAL {class_name}.{method_name}{method_desc}"
+                elif opcode == opcodes.ICONST_0:
+                    body += f"{tab}ICONST_0"
+                elif opcode == opcodes.ICONST_1:
+                    body += f"{tab}ICONST_1"
+                elif opcode == opcodes.ICONST_2:
+                    body += f"{tab}ICONST_2"
+                elif opcode == opcodes.ICONST_3:
+                    body += f"{tab}ICONST_3"
+                elif opcode == opcodes.ICONST_4:
+                    body += f"{tab}ICONST_4"
+                elif opcode == opcodes.PUTFIELD:
+                    index = parse_u2(f)
+                    fieldref = clazz['constant_pool'][index - 1]
+                    class_name = resolve_field_owner(session, package, fieldref)
+                    field_name = fieldref['field_name']
+
+                    body += f"{tab}PUTFIELD {index} // Field: {class_name}.{field_name}"
+                elif opcode == opcodes.NEW_ARRAY:
+                    type = parse_u1(f)
+                    if type == 4: type = 'boolean'
+                    elif type == 5: type = 'char'
+                    elif type == 6: type = 'float'
+                    elif type == 7: type = 'double'
+                    elif type == 8: type = 'byte'
+                    elif type == 9: type = 'short'
+                    elif type == 10: type = 'int'
+                    elif type == 11: type = 'long'
+                    else: type = 'unknown'
+                    body += f"{tab}NEWARRAY // Type: {type}"
+                elif opcode == opcodes.DUP:
+                    body += f"{tab}DUP"
+                elif opcode == opcodes.ICONST_3:
+                    body += f"{tab}ICONST_3"
+                elif opcode == opcodes.BASTORE:
+                    body += f"{tab}BASTORE"
+                elif opcode == opcodes.RETURN:
+                    body += f"{tab}RETURN"
+                elif opcode == opcodes.ARETURN:
+                    body += f"{tab}ARETURN"
+                elif opcode == opcodes.ALOAD_0:
+                    body += f"{tab}ALOAD_0"
+                else:
+                    body += f'{tab}{opcode}'
 
-            if method == 'println':
-                print(provided_string)
+                body += '\n' if f.tell() < len(code) else ''
+        except struct.error as e:
+            raise truncated(f, e)
 
+    return body
 
-    assert False, "Executing code is not implemented yet."
+def decompile_class(clazz: dict, session=None) -> str:
+    package = package_of(clazz['name'])
 
-def decompile_class(clazz: dict) -> str:
     lines = []
     lines.append("// Decompiled with Pyva Decompiler by RareHyperIonYT")
     lines.append(f"// Class Version: {clazz['major'] - 44}")
+
+    if session is not None:
+        if package:
+            lines.append(f"package {package.replace('/', '.')};")
+        imports = session.get_package(package)['imports']
+        if len(imports) > 0:
+            lines.append('')
+            for name in imports:
+                lines.append(f"import {name};")
+        lines.append('')
     
     class_line = ""
 
@@ -108,15 +258,15 @@ def decompile_class(clazz: dict) -> str:
         elif access == 'ACC_ENUM':
             class_type += 'enum '
 
-    class_line += f"{class_type} {clazz['name']}"
+    class_line += f"{class_type} {resolve_class_name(session, package, clazz['name'])}"
 
     if clazz['super_name'] != 'java/lang/Object':
-        class_line += f" extends {clazz['super_name']}"
+        class_line += f" extends {resolve_class_name(session, package, clazz['super_name'])}"
 
     if len(clazz['interfaces']) > 0:
         class_line += ' implements '
         for i, interface in enumerate(clazz['interfaces']):
-            class_line += interface
+            class_line += resolve_class_name(session, package, interface)
             if i != 0 and i != len(clazz['interfaces'] - 1):
                 class_line += ', '
 
@@ -134,6 +284,8 @@ def decompile_class(clazz: dict) -> str:
                 field_line += 'private '
             elif access == 'ACC_PROTECTED':
                 field_line += 'protected '
+            elif access == 'ACC_STATIC':
+                field_line += 'static '
             elif access == 'ACC_FINAL':
                 field_line += 'final '
             elif access == 'ACC_SYNTHETIC':
@@ -145,35 +297,22 @@ def decompile_class(clazz: dict) -> str:
             elif access == 'ACC_TRANSIENT':
                 field_line += 'transient '
         
-        field_desc = field['desc']
+        field_desc = resolve_type(session, package, field['desc'])
         field_line += field_desc
         field_line += f" {field['name']}"
 
-        if len(field['attributes']) == 0:
-            field_line += ';'
-        else:
-            field_line += ' = '
-            for attribute in field['attributes']:
-                if attribute['name'] == 'ConstantValue':
-                    with io.BytesIO(attribute['info']) as f:
-                        name_index = parse_u2(f)
-                        constant = clazz['constant_pool'][name_index - 1]
-
-                        if constant['tag'] == 'CONSTANT_Integer':
-                            value = constant['bytes']
-
-                            if value == 0:
-                                field_line += 'false;'
-                            elif value == 1:
-                                field_line += 'true;'
-                            else:
-                                assert False, "Unexpected value for boolean: {constant}"
-                        else:
-                            assert False, f"We don't support constant {constant['tag']} for field decompilation yet."
-                else:
-                    assert False, f"We don't support attribute {attribute['name']} for field decompilation yet."
-                
-            
+        initializer = ';'
+
+        # Only ConstantValue affects the declaration, other field attributes are skipped.
+        for attribute in field['attributes']:
+            if attribute['name'] == 'ConstantValue':
+                try:
+                    initializer = f" = {format_constant_value(clazz, field, attribute['info'])};"
+                except Exception as e:
+                    clazz['errors'].append(failure('decompile', e, clazz['name'], field['name']))
+                    initializer = f"; // Failed to decompile ConstantValue: {e}"
+
+        field_line += initializer
         lines.append(field_line)
 
     
@@ -182,6 +321,9 @@ def decompile_class(clazz: dict) -> str:
     for method in clazz['methods']:
         method_line = '    '
 
+        if session is not None and session.find_overridden(clazz['name'], method['name'], method['descriptor']) is not None:
+            lines.append('    @Override')
+
         for access in method['access_flags']:
             if access == 'ACC_PUBLIC':
                 method_line += 'public '
@@ -189,6 +331,8 @@ def decompile_class(clazz: dict) -> str:
                 method_line += 'private '
             elif access == 'ACC_PROTECTED':
                 method_line += 'protected '
+            elif access == 'ACC_STATIC':
+                method_line += 'static '
             elif access == 'ACC_FINAL':
                 method_line += 'final '
             elif access == 'ACC_SYNTHETIC':
@@ -208,6 +352,8 @@ def decompile_class(clazz: dict) -> str:
                 
 
         args, return_type = method['desc']
+        args = [resolve_type(session, package, arg) for arg in args]
+        return_type = resolve_type(session, package, return_type)
 
         method_line += f"{return_type} "
         method_line += f"{method['name']}({', '.join(args)}) " + "{\n"
@@ -216,98 +362,17 @@ def decompile_class(clazz: dict) -> str:
             name = attribute['name']
 
             if name == 'Code':
-                tab = '        '
-                code = attribute['info']['code']
-                with io.BytesIO(code) as f:
-                    while f.tell() < len(code):
-                        opcode = parse_u1(f)
-
-
-                        if opcode == opcodes.GET_STATIC:
-                            index = parse_u2(f)
-
-                            fieldref = clazz['constant_pool'][index - 1]
-
-                            class_name = fieldref['class_name']
-                            field_name = fieldref['field_name']
-                            field_desc = fieldref['field_desc']
-
-
-
-                            method_line += f"{tab}GETSTATIC {class_name}.{field_name} // RETURN: {field_desc}"
-                        elif opcode == opcodes.LDC:
-                            index = parse_u1(f)
-
-                            name = clazz['constant_pool'][index - 1]['value']
-
-                            method_line += f"{tab}LDC \"{name}\""
-                        elif opcode == opcodes.INVOKE_VIRTUAL:
-                            index = parse_u2(f)
-
-                            methodref = clazz['constant_pool'][index - 1]
-                            class_name = methodref['class_name']
-                            method_name = methodref['method_name']
-                            method_desc = methodref['method_desc']
-
-                            method_line += f"{tab}INVOKEVIRTUAL {class_name}.{method_name}{method_desc}"
-                        elif opcode == opcodes.INVOKE_SPECIAL:
-                            index = parse_u2(f)
-
-                            methodref = clazz['constant_pool'][index - 1]
-                            class_name = methodref['class_name']
-                            method_name = methodref['method_name']
-                            method_desc = methodref['method_desc']
-
-                            method_line += f"{tab}INVOKESPECIAL {class_name}.{method_name}{method_desc}"
-                        elif opcode == opcodes.ICONST_0:
-                            method_line += f"{tab}ICONST_0"
-                        elif opcode == opcodes.ICONST_1:
-                            method_line += f"{tab}ICONST_1"
-                        elif opcode == opcodes.ICONST_2:
-                            method_line += f"{tab}ICONST_2"
-                        elif opcode == opcodes.ICONST_3:
-                            method_line += f"{tab}ICONST_3"
-                        elif opcode == opcodes.ICONST_4:
-                            method_line += f"{tab}ICONST_4"
-                        elif opcode == opcodes.PUTFIELD:
-                            index = parse_u2(f)
-                            fieldref = clazz['constant_pool'][index - 1]
-                            class_name = fieldref['class_name']
-                            field_name = fieldref['field_name']
-
-                            method_line += f"{tab}PUTFIELD {index} // Field: {class_name}.{field_name}"
-                        elif opcode == opcodes.NEW_ARRAY:
-                            type = parse_u1(f)
-                            if type == 4: type = 'boolean'
-                            elif type == 5: type = 'char'
-                            elif type == 6: type = 'float'
-                            elif type == 7: type = 'double'
-                            elif type == 8: type = 'byte'
-                            elif type == 9: type = 'short'
-                            elif type == 10: type = 'int'
-                            elif type == 11: type = 'long'
-                            else: type = 'unknown'
-                            method_line += f"{tab}NEWARRAY // Type: {type}"
-                        elif opcode == opcodes.DUP:
-                            method_line += f"{tab}DUP"
-                        elif opcode == opcodes.ICONST_3:
-                            method_line += f"{tab}ICONST_3"
-                        elif opcode == opcodes.BASTORE:
-                            method_line += f"{tab}BASTORE"
-                        elif opcode == opcodes.RETURN:
-                            method_line += f"{tab}RETURN"
-                        elif opcode == opcodes.ARETURN:
-                            method_line += f"{tab}ARETURN"
-                        elif opcode == opcodes.ALOAD_0:
-                            method_line += f"{tab}ALOAD_0"
-                        else:
-                            method_line += f'{tab}{opcode}'
-
-                        method_line += '\n' if f.tell() < len(code) else ''
-                            
-                        #else:
-                            #assert False, f"We do not support opcode {opcode} for decompilation yet."
-                            
+                info = attribute['info']
+
+                if isinstance(info, dict):
+                    try:
+                        method_line += decompile_code(clazz, info['code'], session, package)
+                    except Exception as e:
+                        clazz['errors'].append(failure('decompile', e, clazz['name'], method['name'] + method['descriptor']))
+                        method_line += format_bytecode(info['code'], f"Failed to decompile: {type(e).__name__}: {e}")
+                else:
+                    # parse_code_info() failed in clean(), the failure is already recorded.
+                    method_line += format_bytecode(info, "Failed to parse Code attribute")
 
 
         
@@ -328,6 +393,10 @@ def parse_class(file_path):
         return clazz
 
 
+def print_errors(errors: [dict]):
+    for error in errors:
+        location = error['class'] if error['method'] is None else f"{error['class']}.{error['method']}"
+        print(f"[{error['stage']}] {location}: {error['error']}", file=sys.stderr)
 
 parser = argparse.ArgumentParser(description="Process some arguments.")
     
@@ -336,7 +405,7 @@ parser.add_argument(
     "-input",
     dest="input_file",
     required=True,
-    help="Path to the class file."
+    help="Path to the class file, or a directory / jar of classes to decompile together."
 )
 
 parser.add_argument(
@@ -347,16 +416,181 @@ parser.add_argument(
     help="Enable debug mode. (true/false)"
 )
 
-args = parser.parse_args()
+parser.add_argument(
+    "-output",
+    dest="output_file",
+    default=None,
+    help="Write the decompiled sources into a deduplicated zip archive instead of printing them."
+)
+
+parser.add_argument(
+    "-diff",
+    dest="diff_file",
+    default=None,
+    help="Older jar / directory to compare -input against, prints a member-level diff as JSON."
+)
 
-input_file = args.input_file
-debug_mode = args.debug
+parser.add_argument(
+    "-memprofile",
+    dest="memprofile_file",
+    default=None,
+    help="Profile memory per stage with tracemalloc and write a JSON report to this path."
+)
 
-clazz = parse_class(input_file)
-result = decompile_class(clazz)
+parser.add_argument(
+    "-workers",
+    dest="workers",
+    type=int,
+    default=1,
+    help="Parse the classes of a directory / jar in this many processes, they are handed back in shared memory."
+)
 
-if debug_mode:
-    pp.pprint(clazz)
-else:
-    print()
-    print('\n'.join(result))
+def emit(clazz: dict, result: [str], archive):
+    if debug_mode:
+        pp.pprint(clazz)
+    elif archive is not None:
+        header, body = split_source(result)
+        archive.add(clazz['name'] + '.java', header, body, package_of(clazz['name']))
+    else:
+        print()
+        print('\n'.join(result))
+
+def share_classes(session, class_names: [str], blocks: list) -> dict:
+    # Workers read and parse the classes, each comes back as a packed class in a shared memory block
+    # and is cached as a lazily decoded SharedClass view. The views only hold what the decompiler
+    # looked at, so every class stays cached for the run. The blocks are appended to blocks,
+    # the caller releases and unlinks them once it is done with the session. Returns the parse
+    # failures by class name.
+    session.max_cached_classes = max(session.max_cached_classes, len(class_names))
+    tasks = [(class_name, session.sources[class_name]) for class_name in class_names]
+
+    # Started before the pool so the workers share it, a tracker of their own would unlink
+    # the blocks they created when they exit.
+    resource_tracker.ensure_running()
+
+    failures = {}
+
+    with multiprocessing.Pool(args.workers) as pool:
+        for class_name, (block_name, error) in zip(class_names, pool.imap(read_and_share, tasks, chunksize=16)):
+            if error is not None:
+                failures[class_name] = error
+                continue
+
+            shm, shared = attach_class(block_name)
+            blocks.append((shm, shared))
+            session.cache_class(shared.clean())
+
+    return failures
+
+def run(archive) -> int:
+    if args.diff_file is not None:
+        diff = diff_archives(args.diff_file, input_file, decompile_code)
+        print(json.dumps(diff, indent=1))
+        print_errors(diff['errors'])
+    elif os.path.isdir(input_file) or input_file.endswith('.jar'):
+        session = DecompilerSession()
+        if os.path.isdir(input_file):
+            class_names = session.add_directory(input_file)
+        else:
+            class_names = session.add_jar(input_file)
+
+        errors = []
+        failures = {}
+        blocks = []
+
+        try:
+            if args.workers > 1 and not debug_mode:
+                failures = share_classes(session, class_names, blocks)
+
+            for class_name in class_names:
+                # A class which fails to parse or decompile is recorded and skipped, the rest of the run goes on.
+                if class_name in failures:
+                    errors.append(failures[class_name])
+                    continue
+
+                try:
+                    clazz = session.get_class(class_name)
+                except Exception as e:
+                    errors.append(failure('parse', e, class_name))
+                    continue
+
+                try:
+                    result = decompile_class(clazz, session)
+                except Exception as e:
+                    errors += clazz['errors']
+                    errors.append(failure('decompile', e, class_name))
+                    continue
+
+                errors += clazz['errors']
+                emit(clazz, result, archive)
+        finally:
+            session.close()
+            for shm, shared in blocks:
+                shared.release()
+                shm.close()
+                shm.unlink()
+
+        print_errors(errors)
+
+        # Method-level failures still leave a usable source, a class which was not emitted at all does not.
+        if any(error['method'] is None for error in errors):
+            return 1
+    else:
+        try:
+            clazz = parse_class(input_file)
+            errors = []
+        except Exception as e:
+            clazz = None
+            errors = [failure('parse', e, input_file)]
+
+        if clazz is not None:
+            try:
+                result = decompile_class(clazz)
+            except Exception as e:
+                result = None
+                clazz['errors'].append(failure('decompile', e, clazz['name']))
+
+            if result is not None:
+                emit(clazz, result, archive)
+            errors += clazz['errors']
+
+        print_errors(errors)
+
+        if any(error['method'] is None for error in errors):
+            return 1
+
+    return 0
+
+# Worker processes of -workers import this module, only the main process runs the program.
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    input_file = args.input_file
+    debug_mode = args.debug
+    output_file = args.output_file
+
+    profiler = None
+
+    if args.memprofile_file is not None:
+        # The stages are swapped for profiled wrappers, callers look them up at call time.
+        profiler = MemoryProfiler()
+        ClassReader.read = profiler.wrap('ClassReader.read', ClassReader.read)
+        ClassReader.clean = profiler.wrap('clean', ClassReader.clean)
+        classreader.parse_code_info = profiler.wrap('parse_code_info', classreader.parse_code_info)
+        decompile_class = profiler.wrap('decompile_class', decompile_class)
+        profiler.start()
+
+    if output_file is not None and not debug_mode:
+        # The with block makes sure the archive gets its manifest and central directory even if the run fails.
+        with SourceArchive(output_file) as archive:
+            exit_code = run(archive)
+        print(f"Wrote {len(archive.manifest)} sources ({len(archive.stored)} unique, {archive.bytes_stored} of {archive.bytes_in} bytes kept) to {output_file}", file=sys.stderr)
+    else:
+        exit_code = run(None)
+
+    if profiler is not None:
+        report = profiler.write(args.memprofile_file)
+        profiler.stop()
+        print_report(report)
+
+    sys.exit(exit_code)
@@ -0,0 +1,136 @@
+import functools
+import json
+import sys
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def peak_rss() -> int:
+    # Peak resident set size of this process in bytes, None where resource is not available (Windows).
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+class MemoryProfiler():
+    # Records what every stage leaves allocated and how high traced memory went while it ran, both from
+    # tracemalloc.get_traced_memory() around each call. Allocation sites need snapshots, which cost time
+    # proportional to the whole traced heap, so they are only taken around every sample_every-th
+    # outermost call of a stage. Stages are inclusive, clean includes the parse_code_info calls made
+    # from it, and the sites of a nested stage show up under the stage enclosing it.
+    def __init__(self, top_sites=10, sample_every=16):
+        self.top_sites = top_sites
+        self.sample_every = sample_every
+        self.stages = {}
+        self.sites = {}
+        self.frames = []
+        self.peak = 0
+        self.ignored = {tracemalloc.__file__, __file__}
+
+    def start(self):
+        tracemalloc.start()
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def traced_peak(self) -> int:
+        # Every stage boundary resets tracemalloc's peak, the run's peak is kept here instead.
+        if tracemalloc.is_tracing() and not self.frames:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        return self.peak
+
+    def enter(self, name: str):
+        current, peak = tracemalloc.get_traced_memory()
+
+        # The enclosing stage keeps the peak it reached so far, tracemalloc only tracks one.
+        if self.frames:
+            parent = self.frames[-1]
+            parent['peak'] = max(parent['peak'], peak)
+        else:
+            self.peak = max(self.peak, peak)
+
+        stage = self.stages.setdefault(name, {'calls': 0, 'sampled_calls': 0, 'bytes': 0, 'peak_bytes': 0})
+        snapshot = None
+        held = 0
+
+        # Only outermost calls are sampled, so a held snapshot never counts towards another stage's bytes or peak.
+        if not self.frames and stage['calls'] % self.sample_every == 0:
+            snapshot = tracemalloc.take_snapshot()
+            held = tracemalloc.get_traced_memory()[0] - current
+            current += held
+
+        tracemalloc.reset_peak()
+        self.frames.append({'name': name, 'start': current, 'peak': current, 'held': held, 'snapshot': snapshot})
+
+    def exit(self):
+        current, peak = tracemalloc.get_traced_memory()
+        frame = self.frames.pop()
+        peak = max(frame['peak'], peak)
+
+        stage = self.stages[frame['name']]
+        stage['calls'] += 1
+        stage['bytes'] += current - frame['start']
+        stage['peak_bytes'] = max(stage['peak_bytes'], peak - frame['start'])
+
+        if self.frames:
+            parent = self.frames[-1]
+            parent['peak'] = max(parent['peak'], peak)
+        else:
+            self.peak = max(self.peak, peak - frame['held'])
+
+        if frame['snapshot'] is not None:
+            stage['sampled_calls'] += 1
+            sites = self.sites.setdefault(frame['name'], {})
+
+            # The diff is filtered rather than the snapshots, filter_traces() goes through every trace in Python.
+            for diff in tracemalloc.take_snapshot().compare_to(frame['snapshot'], 'lineno'):
+                location = diff.traceback[0]
+                if (diff.size_diff == 0 and diff.count_diff == 0) or location.filename in self.ignored:
+                    continue
+
+                site = sites.setdefault(f"{location.filename}:{location.lineno}", [0, 0])
+                site[0] += diff.size_diff
+                site[1] += diff.count_diff
+
+        # The snapshots are gone before tracking a new peak.
+        frame = None
+        tracemalloc.reset_peak()
+
+    def wrap(self, name: str, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+        return wrapper
+
+    def report(self) -> dict:
+        top_sites = {}
+        for name, sites in self.sites.items():
+            ranked = sorted(sites.items(), key=lambda item: abs(item[1][0]), reverse=True)[:self.top_sites]
+            top_sites[name] = [{'site': site, 'bytes': size, 'count': count} for site, (size, count) in ranked]
+
+        return {
+            'peak_rss_bytes': peak_rss(),
+            'traced_peak_bytes': self.traced_peak() if tracemalloc.is_tracing() else None,
+            'stages': self.stages,
+            'top_sites': top_sites
+        }
+
+    def write(self, file_path) -> dict:
+        report = self.report()
+        with open(file_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        return report
+
+def print_report(report: dict, file=sys.stderr):
+    print(f"{'stage':<20}{'calls':>8}{'sampled':>9}{'bytes':>14}{'peak bytes':>14}", file=file)
+    for name, stage in report['stages'].items():
+        print(f"{name:<20}{stage['calls']:>8}{stage['sampled_calls']:>9}{stage['bytes']:>14}{stage['peak_bytes']:>14}", file=file)
+    if report['peak_rss_bytes'] is not None:
+        print(f"Peak RSS: {report['peak_rss_bytes']} bytes", file=file)
@@ -11,7 +11,10 @@ CONSTANT_NameAndType        = 12
 CONSTANT_Utf8               = 1
 CONSTANT_MethodHandle       = 15
 CONSTANT_MethodType         = 16
+CONSTANT_Dynamic            = 17
 CONSTANT_InvokeDynamic      = 18
+CONSTANT_Module             = 19
+CONSTANT_Package            = 20
 
 INVOKE_VIRTUAL = 0xB6
 INVOKE_SPECIAL = 0xb7
@@ -36,4 +39,26 @@ ALOAD_0 = 0x2a
 NEW_ARRAY = 0xbc
 
 RETURN  = 0xB1
-ARETURN = 0xb0
\ No newline at end of file
+ARETURN = 0xb0
+TABLESWITCH  = 0xaa
+LOOKUPSWITCH = 0xab
+WIDE         = 0xc4
+IINC         = 0x84
+
+# opcode -> operand bytes, opcodes missing from the table take no operands.
+# tableswitch, lookupswitch and wide are variable length and handled by the caller.
+operand_lengths = {
+    0x10: 1, 0x11: 2, 0x12: 1, 0x13: 2, 0x14: 2,
+    0x15: 1, 0x16: 1, 0x17: 1, 0x18: 1, 0x19: 1,
+    0x36: 1, 0x37: 1, 0x38: 1, 0x39: 1, 0x3a: 1,
+    0x84: 2,
+    0x99: 2, 0x9a: 2, 0x9b: 2, 0x9c: 2, 0x9d: 2, 0x9e: 2, 0x9f: 2, 0xa0: 2,
+    0xa1: 2, 0xa2: 2, 0xa3: 2, 0xa4: 2, 0xa5: 2, 0xa6: 2, 0xa7: 2, 0xa8: 2, 0xa9: 1,
+    0xb2: 2, 0xb3: 2, 0xb4: 2, 0xb5: 2, 0xb6: 2, 0xb7: 2, 0xb8: 2, 0xb9: 4, 0xba: 4,
+    0xbb: 2, 0xbc: 1, 0xbd: 2, 0xc0: 2, 0xc1: 2, 0xc5: 3, 0xc6: 2, 0xc7: 2, 0xc8: 4, 0xc9: 4
+}
+
+# opcodes whose operand starts with a constant pool index, ldc is the only one with a u1 index.
+constant_pool_operands = {
+    0x12, 0x13, 0x14, 0xb2, 0xb3, 0xb4, 0xb5, 0xb6, 0xb7, 0xb8, 0xb9, 0xba, 0xbb, 0xbd, 0xc0, 0xc1, 0xc5
+}
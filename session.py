@@ -0,0 +1,260 @@
+import os
+import re
+import zipfile
+
+from collections import OrderedDict
+from classreader import ClassReader, read_class_name
+
+def package_of(class_name: str) -> str:
+    return class_name.rpartition('/')[0]
+
+def simple_name_of(class_name: str) -> str:
+    return class_name.rpartition('/')[2]
+
+class DecompilerSession():
+    # Holds every class of an application so references can be resolved across classes.
+    # Parsed classes live in an LRU cache and are re-parsed from their source when evicted,
+    # the supertype / member / package tables are small and kept for the whole session.
+    def __init__(self, max_cached_classes=1024):
+        self.max_cached_classes = max_cached_classes
+        self.sources = {}
+        self.classes = OrderedDict()
+        self.archives = {}
+
+        self.member_tables = {}
+        self.supertype_table = {}
+        self.method_table = {}
+        self.field_table = {}
+        self.package_table = {}
+
+    def add_class_bytes(self, class_bytes: bytes) -> str:
+        clazz = parse_class_bytes(class_bytes)
+        self.sources[clazz['name']] = ('bytes', class_bytes)
+        self.cache_class(clazz)
+        return clazz['name']
+
+    def add_class_file(self, file_path) -> str:
+        with open(file_path, "rb") as f:
+            clazz = parse_class_bytes(f.read())
+        self.sources[clazz['name']] = ('file', file_path)
+        self.cache_class(clazz)
+        return clazz['name']
+
+    def add_directory(self, directory) -> [str]:
+        # Classes are keyed by the internal name from their header, the directory does not have to be
+        # the classpath root. A file whose header cannot be read keeps its path as name so the failure
+        # is reported when it is decompiled.
+        names = []
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith('.class'):
+                    path = os.path.join(root, file)
+                    with open(path, "rb") as f:
+                        class_bytes = f.read()
+
+                    try:
+                        name = read_class_name(class_bytes)
+                    except Exception:
+                        name = os.path.relpath(path, directory)[:-len('.class')].replace(os.sep, '/')
+
+                    if name not in self.sources:
+                        names.append(name)
+                    self.sources[name] = ('file', path)
+        return names
+
+    def add_jar(self, jar_path) -> [str]:
+        # The jar root is the classpath root, so entry paths are the internal names.
+        archive = zipfile.ZipFile(jar_path)
+        self.archives[jar_path] = archive
+        names = []
+        for entry in archive.namelist():
+            if entry.endswith('.class') and not entry.startswith('META-INF/'):
+                name = entry[:-len('.class')]
+                self.sources[name] = ('jar', (jar_path, entry))
+                names.append(name)
+        return names
+
+    def close(self):
+        for archive in self.archives.values():
+            archive.close()
+        self.archives = {}
+
+    def read_source(self, name: str) -> bytes:
+        kind, source = self.sources[name]
+        if kind == 'bytes':
+            return source
+        elif kind == 'file':
+            with open(source, "rb") as f:
+                return f.read()
+        else:
+            jar_path, entry = source
+            return self.archives[jar_path].read(entry)
+
+    def cache_class(self, clazz: dict):
+        self.classes[clazz['name']] = clazz
+        self.classes.move_to_end(clazz['name'])
+        while len(self.classes) > self.max_cached_classes:
+            self.classes.popitem(last=False)
+
+    def get_class(self, name: str) -> dict:
+        # Returns None for classes outside the session (e.g. java/lang/Object).
+        clazz = self.classes.get(name)
+        if clazz is not None:
+            self.classes.move_to_end(name)
+            return clazz
+
+        if name not in self.sources:
+            return None
+
+        clazz = parse_class_bytes(self.read_source(name))
+        self.cache_class(clazz)
+        return clazz
+
+    def try_get_class(self, name: str) -> dict:
+        # Lookups on behalf of other classes treat a class which fails to parse as missing,
+        # the failure itself is reported when that class is decompiled.
+        try:
+            return self.get_class(name)
+        except Exception:
+            return None
+
+    def get_members(self, name: str) -> dict:
+        if name in self.member_tables:
+            return self.member_tables[name]
+
+        clazz = self.try_get_class(name)
+        if clazz is None:
+            members = None
+        else:
+            members = {
+                'super_name': clazz['super_name'],
+                'interfaces': tuple(clazz['interfaces']),
+                'methods': {(method['name'], method['descriptor']): method['access_flags'] for method in clazz['methods']},
+                'fields': {field['name']: field['descriptor'] for field in clazz['fields']},
+            }
+
+        self.member_tables[name] = members
+        return members
+
+    def get_supertypes(self, name: str) -> tuple:
+        # Superclasses first, then interfaces, each type listed once.
+        if name in self.supertype_table:
+            return self.supertype_table[name]
+
+        supertypes = []
+        members = self.get_members(name)
+
+        if members is not None:
+            direct = [members['super_name']] if members['super_name'] else []
+            direct += members['interfaces']
+
+            for supertype in direct:
+                for candidate in (supertype,) + self.get_supertypes(supertype):
+                    if candidate not in supertypes:
+                        supertypes.append(candidate)
+
+        supertypes = tuple(supertypes)
+        self.supertype_table[name] = supertypes
+        return supertypes
+
+    def resolve_method(self, class_name: str, method_name: str, method_desc: str) -> str:
+        # Returns the class which declares the method, or None if it is not part of the session.
+        key = (class_name, method_name, method_desc)
+        if key in self.method_table:
+            return self.method_table[key]
+
+        owner = None
+        for candidate in (class_name,) + self.get_supertypes(class_name):
+            members = self.get_members(candidate)
+            if members is not None and (method_name, method_desc) in members['methods']:
+                owner = candidate
+                break
+
+        self.method_table[key] = owner
+        return owner
+
+    def resolve_field(self, class_name: str, field_name: str) -> tuple:
+        # Returns (owner, descriptor) of the field, or None if it is not part of the session.
+        key = (class_name, field_name)
+        if key in self.field_table:
+            return self.field_table[key]
+
+        resolved = None
+        for candidate in (class_name,) + self.get_supertypes(class_name):
+            members = self.get_members(candidate)
+            if members is not None and field_name in members['fields']:
+                resolved = (candidate, members['fields'][field_name])
+                break
+
+        self.field_table[key] = resolved
+        return resolved
+
+    def find_overridden(self, class_name: str, method_name: str, method_desc: str) -> str:
+        # Returns the supertype whose method is overridden by class_name.method_name.
+        if method_name in ('<init>', '<clinit>'):
+            return None
+
+        for candidate in self.get_supertypes(class_name):
+            members = self.get_members(candidate)
+            if members is None:
+                continue
+
+            access = members['methods'].get((method_name, method_desc))
+            if access is not None and 'ACC_PRIVATE' not in access and 'ACC_STATIC' not in access:
+                return candidate
+
+        return None
+
+    def get_package(self, package: str) -> dict:
+        # Simple names and imports are computed once for every class in the package.
+        if package in self.package_table:
+            return self.package_table[package]
+
+        local = [name for name in self.sources if package_of(name) == package]
+        referenced = set()
+
+        for name in local:
+            clazz = self.try_get_class(name)
+            if clazz is None:
+                continue
+
+            for constant in clazz['constant_pool']:
+                if constant['tag'] == 'CONSTANT_Class' and not constant['name'].startswith('['):
+                    referenced.add(constant['name'])
+
+            # Types used only in declarations never show up as CONSTANT_Class.
+            for member in clazz['fields'] + clazz['methods']:
+                referenced.update(re.findall(r"L([^;]+);", member['descriptor']))
+
+        taken = {simple_name_of(name): name for name in local}
+        by_simple_name = {}
+
+        for name in referenced:
+            if package_of(name) != package:
+                by_simple_name.setdefault(simple_name_of(name), []).append(name)
+
+        simple_names = {name: simple_name_of(name) for name in local}
+        imports = []
+
+        for simple_name, names in by_simple_name.items():
+            # Ambiguous names stay fully qualified.
+            if len(names) != 1 or simple_name in taken:
+                continue
+
+            name = names[0]
+            simple_names[name] = simple_name
+            if package_of(name) != 'java/lang':
+                imports.append(name.replace('/', '.'))
+
+        result = {'simple_names': simple_names, 'imports': sorted(imports)}
+        self.package_table[package] = result
+        return result
+
+    def simple_name(self, class_name: str, package: str) -> str:
+        return self.get_package(package)['simple_names'].get(class_name, class_name)
+
+def parse_class_bytes(class_bytes: bytes) -> dict:
+    classReader = ClassReader(class_bytes)
+    clazz = classReader.read()
+    return classReader.clean(clazz)
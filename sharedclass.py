@@ -0,0 +1,426 @@
+import access_flags
+import opcodes
+import struct
+import zipfile
+
+from multiprocessing import shared_memory
+from classreader import ClassReader, ClassFormatError, constant_pool_layouts, failure, parse_descriptor, parse_field_descriptor, parse_flags
+
+# Flat layout of a class returned by ClassReader.read(), so it can be handed between
+# processes through shared memory instead of being pickled.
+#
+#   header
+#   constant pool table   cp_count records, index - 1 like the parsed constant pool
+#   interfaces table      u2 class indices
+#   member table          fields followed by methods
+#   attribute table       field attributes, method attributes, then class attributes
+#   data                  utf8 bytes and attribute infos (including Code spans)
+#
+# Every offset in the tables is relative to the start of the data section.
+
+MAGIC = b'PYVA'
+
+header_layout    = struct.Struct('>4sHHHHHIIIIII')
+constant_layout  = struct.Struct('>B3xII8s')
+interface_layout = struct.Struct('>H')
+member_layout    = struct.Struct('>HHHII')
+attribute_layout = struct.Struct('>HII')
+
+code_layout             = struct.Struct('>HHI')
+exception_layout        = struct.Struct('>HHHH')
+count_layout            = struct.Struct('>H')
+nested_attribute_layout = struct.Struct('>HI')
+
+int_value   = struct.Struct('>q')
+float_value = struct.Struct('>d')
+
+CONSTANT_Unusable = 0
+
+constant_tags = {name: tag for tag, (name, fmt, keys, slots) in constant_pool_layouts.items()}
+constant_tags['CONSTANT_Utf8'] = opcodes.CONSTANT_Utf8
+constant_tags['CONSTANT_Unusable'] = CONSTANT_Unusable
+
+def pack_flags(names: [str], flags: [(str, int)]) -> int:
+    return sum(mask for (name, mask) in flags if name in names)
+
+def pack_class(clazz: dict) -> bytearray:
+    if 'this_class' not in clazz:
+        raise ValueError("pack_class() takes the dict returned by ClassReader.read(), not a cleaned class")
+
+    data = bytearray()
+    constants = []
+
+    for cp_info in clazz['constant_pool']:
+        tag = constant_tags[cp_info['tag']]
+        a = b = 0
+        value = bytes(8)
+
+        if tag == opcodes.CONSTANT_Utf8:
+            a, b = len(data), len(cp_info['bytes'])
+            data += cp_info['bytes']
+        elif tag in (opcodes.CONSTANT_Float, opcodes.CONSTANT_Double):
+            value = float_value.pack(cp_info['bytes'])
+        elif tag in (opcodes.CONSTANT_Integer, opcodes.CONSTANT_Long):
+            value = int_value.pack(cp_info['bytes'])
+        elif tag != CONSTANT_Unusable:
+            indices = [cp_info[key] for key in constant_pool_layouts[tag][2]]
+            a = indices[0]
+            b = indices[1] if len(indices) > 1 else 0
+
+        constants.append(constant_layout.pack(tag, a, b, value))
+
+    attributes = []
+
+    def pack_attributes(attribute_list):
+        start = len(attributes)
+        for attribute in attribute_list:
+            attributes.append(attribute_layout.pack(attribute['attribute_name_index'], len(data), len(attribute['info'])))
+            data.extend(attribute['info'])
+        return start
+
+    members = []
+    for flags, member_list in ((access_flags.field_access_flags, clazz['fields']), (access_flags.method_access_flags, clazz['methods'])):
+        for member in member_list:
+            start = pack_attributes(member['attributes'])
+            members.append(member_layout.pack(
+                pack_flags(member['access_flags'], flags),
+                member['name_index'],
+                member['descriptor_index'],
+                start,
+                len(member['attributes'])
+            ))
+
+    pack_attributes(clazz['attributes'])
+
+    tables = b''.join(constants) + b''.join(interface_layout.pack(i) for i in clazz['interfaces']) + b''.join(members) + b''.join(attributes)
+
+    header = header_layout.pack(
+        MAGIC,
+        clazz['minor'],
+        clazz['major'],
+        pack_flags(clazz['access_flags'], access_flags.class_access_flags),
+        clazz['this_class'],
+        clazz['super_class'],
+        len(constants),
+        len(clazz['interfaces']),
+        len(clazz['fields']),
+        len(clazz['methods']),
+        len(clazz['attributes']),
+        header_layout.size + len(tables)
+    )
+
+    return bytearray(header) + tables + data
+
+class ConstantPoolView():
+    # Stands in for the cleaned constant pool list (index i at [i - 1]),
+    # every entry is resolved from the buffer the first time it is looked at.
+    def __init__(self, shared):
+        self.shared = shared
+        self.entries = [None] * shared.constant_pool_count
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.entries)
+        entry = self.entries[i]
+        if entry is None:
+            entry = self.entries[i] = self.shared.resolve_constant(i + 1)
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self.entries)):
+            yield self[i]
+
+class MemberView(dict):
+    # A cleaned field / method. name, descriptor and access_flags are set up front since that is all
+    # DecompilerSession looks at, desc and attributes are only parsed when decompile_class() asks for them.
+    def __init__(self, shared, clazz: dict, is_method: bool, start: int, count: int, **members):
+        super().__init__(**members)
+        self.shared = shared
+        self.clazz = clazz
+        self.is_method = is_method
+        self.start = start
+        self.count = count
+
+    def __missing__(self, key):
+        if key == 'desc':
+            value = self.shared.desc(self['descriptor'], self.is_method)
+        elif key == 'attributes':
+            value = self.shared.clean_attributes(self.start, self.count)
+            if self.is_method:
+                for attribute in value:
+                    if attribute['name'] == 'Code':
+                        try:
+                            attribute['info'] = self.shared.code_info(attribute['offset'], attribute['length'])
+                        except ClassFormatError as e:
+                            self.clazz['errors'].append(failure('clean', e, self.clazz['name'], self['name'] + self['descriptor']))
+            for attribute in value:
+                if not isinstance(attribute['info'], dict):
+                    attribute['info'] = bytes(self.shared.data(attribute.pop('offset'), attribute.pop('length')))
+                else:
+                    attribute.pop('offset')
+                    attribute.pop('length')
+        else:
+            raise KeyError(key)
+
+        self[key] = value
+        return value
+
+class SharedClass():
+    # Read-only view over a packed class. The accessors return Utf8 constants, attribute infos and
+    # Code spans as memoryview slices of the underlying buffer, clean() builds a lazily resolved
+    # cleaned class on top of it. release() must be called before the shared memory is closed.
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.strings = {}
+        self.descriptors = {}
+        self.flags = {}
+
+        (magic, self.minor, self.major, self.access_flags, self.this_class, self.super_class,
+         self.constant_pool_count, self.interfaces_count, self.fields_count, self.methods_count,
+         self.attributes_count, self.data_offset) = header_layout.unpack_from(self.view, 0)
+
+        if magic != MAGIC:
+            raise ClassFormatError(f"Not a packed class: {bytes(magic)}")
+
+        self.constants_offset = header_layout.size
+        self.interfaces_offset = self.constants_offset + self.constant_pool_count * constant_layout.size
+        self.members_offset = self.interfaces_offset + self.interfaces_count * interface_layout.size
+        self.attributes_offset = self.members_offset + (self.fields_count + self.methods_count) * member_layout.size
+
+    def release(self):
+        self.view.release()
+
+    def data(self, offset: int, length: int) -> memoryview:
+        start = self.data_offset + offset
+        return self.view[start:start + length]
+
+    def constant(self, index: int) -> dict:
+        # Same shape as an entry of ClassReader.read()['constant_pool'], Utf8 bytes are a memoryview.
+        tag, a, b, value = constant_layout.unpack_from(self.view, self.constants_offset + (index - 1) * constant_layout.size)
+
+        if tag == CONSTANT_Unusable:
+            return {'tag': 'CONSTANT_Unusable'}
+        elif tag == opcodes.CONSTANT_Utf8:
+            return {'tag': 'CONSTANT_Utf8', 'bytes': self.data(a, b)}
+
+        name, fmt, keys, slots = constant_pool_layouts[tag]
+        cp_info = {'tag': name}
+
+        if tag in (opcodes.CONSTANT_Float, opcodes.CONSTANT_Double):
+            cp_info['bytes'] = float_value.unpack(value)[0]
+        elif tag in (opcodes.CONSTANT_Integer, opcodes.CONSTANT_Long):
+            cp_info['bytes'] = int_value.unpack(value)[0]
+        else:
+            cp_info.update(zip(keys, (a, b)))
+
+        return cp_info
+
+    def utf8(self, index: int) -> memoryview:
+        tag, offset, length, value = constant_layout.unpack_from(self.view, self.constants_offset + (index - 1) * constant_layout.size)
+        if tag != opcodes.CONSTANT_Utf8:
+            raise ClassFormatError(f"Constant {index} is not CONSTANT_Utf8")
+        return self.data(offset, length)
+
+    def string(self, index: int) -> str:
+        string = self.strings.get(index)
+        if string is None:
+            string = self.strings[index] = str(self.utf8(index), 'utf-8')
+        return string
+
+    def desc(self, descriptor: str, is_method: bool):
+        # Overloads and accessors share descriptors, each is parsed once per class.
+        desc = self.descriptors.get(descriptor)
+        if desc is None:
+            desc = self.descriptors[descriptor] = parse_descriptor(descriptor) if is_method else parse_field_descriptor(descriptor)
+        return desc
+
+    def member_flags(self, access: int, is_method: bool) -> [str]:
+        flags = self.flags.get((access, is_method))
+        if flags is None:
+            flags = self.flags[(access, is_method)] = parse_flags(access, access_flags.method_access_flags if is_method else access_flags.field_access_flags)
+        return list(flags)
+
+    def resolve_constant(self, index: int) -> dict:
+        # Same shape as an entry of the constant pool after ClassReader.clean().
+        cp_info = self.constant(index)
+        tag = cp_info['tag']
+
+        if tag == 'CONSTANT_Utf8':
+            cp_info['bytes'] = bytes(cp_info['bytes'])
+        elif tag == 'CONSTANT_String':
+            value = bytes(self.utf8(cp_info.pop('string_index')))
+            try:
+                cp_info['value'] = value.decode('utf-8')
+            except UnicodeDecodeError:
+                cp_info['value'] = value
+        elif tag == 'CONSTANT_Class':
+            cp_info['name'] = self.string(cp_info.pop('name_index'))
+        elif tag in ('CONSTANT_Methodref', 'CONSTANT_Fieldref'):
+            kind = 'method' if tag == 'CONSTANT_Methodref' else 'field'
+            name_and_type = self.constant(cp_info.pop('name_and_type_index'))
+            cp_info['class_name'] = self.string(self.constant(cp_info.pop('class_index'))['name_index'])
+            cp_info[f"{kind}_name"] = self.string(name_and_type['name_index'])
+            cp_info[f"{kind}_desc"] = self.string(name_and_type['descriptor_index'])
+
+        return cp_info
+
+    def attributes(self, start: int, count: int) -> [dict]:
+        attributes = []
+        for i in range(start, start + count):
+            name_index, offset, length = attribute_layout.unpack_from(self.view, self.attributes_offset + i * attribute_layout.size)
+            attributes.append({'attribute_name_index': name_index, 'info': self.data(offset, length)})
+        return attributes
+
+    def member(self, i: int, flags: [(str, int)]) -> dict:
+        access, name_index, descriptor_index, start, count = member_layout.unpack_from(self.view, self.members_offset + i * member_layout.size)
+        return {
+            'access_flags': parse_flags(access, flags),
+            'name_index': name_index,
+            'descriptor_index': descriptor_index,
+            'attributes': self.attributes(start, count)
+        }
+
+    def field(self, i: int) -> dict:
+        return self.member(i, access_flags.field_access_flags)
+
+    def method(self, i: int) -> dict:
+        return self.member(self.fields_count + i, access_flags.method_access_flags)
+
+    def method_code(self, i: int) -> memoryview:
+        # Bytecode of the method's Code attribute, or None for abstract / native methods.
+        for attribute in self.method(i)['attributes']:
+            if self.utf8(attribute['attribute_name_index']) == b'Code':
+                info = attribute['info']
+                code_length = int.from_bytes(info[4:8], 'big')
+                return info[8:8 + code_length]
+        return None
+
+    def clean_attributes(self, start: int, count: int) -> [dict]:
+        # Attribute infos are left as offsets, MemberView decides whether to parse or copy them.
+        attributes = []
+        for i in range(start, start + count):
+            name_index, offset, length = attribute_layout.unpack_from(self.view, self.attributes_offset + i * attribute_layout.size)
+            attributes.append({'name': self.string(name_index), 'info': None, 'offset': offset, 'length': length})
+        return attributes
+
+    def code_info(self, offset: int, length: int) -> dict:
+        # parse_code_info() read straight from the buffer.
+        start = self.data_offset + offset
+        end = start + length
+
+        try:
+            max_stack, max_locals, code_length = code_layout.unpack_from(self.view, start)
+            position = start + code_layout.size
+
+            code = {'max_stack': max_stack, 'max_locals': max_locals}
+            code['code'] = bytes(self.view[position:position + code_length])
+            position += code_length
+
+            exceptions = []
+            for i in range(count_layout.unpack_from(self.view, position)[0]):
+                start_pc, end_pc, handler_pc, catch_type = exception_layout.unpack_from(self.view, position + count_layout.size + i * exception_layout.size)
+                exceptions.append({'start_pc': start_pc, 'end_pc': end_pc, 'handler_pc': handler_pc, 'catch_type': catch_type})
+            position += count_layout.size + len(exceptions) * exception_layout.size
+            code['exception_table'] = exceptions
+
+            attributes = []
+            attributes_count = count_layout.unpack_from(self.view, position)[0]
+            position += count_layout.size
+            for i in range(attributes_count):
+                name_index, attribute_length = nested_attribute_layout.unpack_from(self.view, position)
+                position += nested_attribute_layout.size
+                attributes.append({'attribute_name_index': name_index, 'info': bytes(self.view[position:position + attribute_length])})
+                position += attribute_length
+            code['attributes'] = attributes
+        except struct.error as e:
+            raise ClassFormatError(f"Truncated Code attribute: {e}")
+
+        if position > end:
+            raise ClassFormatError(f"Code attribute overruns its length by {position - end} bytes")
+
+        return code
+
+    def clean(self) -> dict:
+        # Same shape as ClassReader.clean() output, for decompile_class() and DecompilerSession, without
+        # building the read() model first. Constants are resolved through ConstantPoolView and members
+        # are MemberViews, so only what the consumer looks at gets decoded. Decoded strings and Code
+        # are copies, nothing but this SharedClass keeps the buffer referenced.
+        clazz = {}
+        clazz['errors'] = []
+        clazz['magic'] = 'CAFEBABE'
+        clazz['minor'] = self.minor
+        clazz['major'] = self.major
+        clazz['constant_pool'] = constant_pool = ConstantPoolView(self)
+        clazz['access_flags'] = parse_flags(self.access_flags, access_flags.class_access_flags)
+        clazz['name'] = constant_pool[self.this_class - 1]['name']
+        clazz['super_name'] = constant_pool[self.super_class - 1]['name']
+        clazz['interfaces'] = [constant_pool[interface_layout.unpack_from(self.view, self.interfaces_offset + i * interface_layout.size)[0] - 1]['name'] for i in range(self.interfaces_count)]
+
+        fields = []
+        methods = []
+
+        for i in range(self.fields_count + self.methods_count):
+            access, name_index, descriptor_index, start, count = member_layout.unpack_from(self.view, self.members_offset + i * member_layout.size)
+            is_method = i >= self.fields_count
+            member = MemberView(
+                self, clazz, is_method, start, count,
+                access_flags=self.member_flags(access, is_method),
+                name=self.string(name_index),
+                descriptor=self.string(descriptor_index)
+            )
+            (methods if is_method else fields).append(member)
+
+        clazz['fields'] = fields
+        clazz['methods'] = methods
+
+        total_attributes = (self.data_offset - self.attributes_offset) // attribute_layout.size
+        attributes = self.clean_attributes(total_attributes - self.attributes_count, self.attributes_count)
+        for attribute in attributes:
+            attribute['info'] = bytes(self.data(attribute.pop('offset'), attribute.pop('length')))
+        clazz['attributes'] = attributes
+
+        return clazz
+
+def share_class(clazz: dict) -> shared_memory.SharedMemory:
+    # Packs a class into a new shared memory block, pass shm.name to the other process.
+    # The creating process is responsible for calling close() and unlink().
+    packed = pack_class(clazz)
+    shm = shared_memory.SharedMemory(create=True, size=max(len(packed), 1))
+    shm.buf[:len(packed)] = packed
+    return shm
+
+def attach_class(name: str) -> (shared_memory.SharedMemory, SharedClass):
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, SharedClass(shm.buf)
+
+# Blocks created by this worker process. Their handles stay open for the life of the pool, on Windows
+# a block is freed as soon as its last handle closes, which could be before the consumer attaches.
+worker_blocks = []
+worker_archives = {}
+
+def read_and_share(task: (str, tuple)) -> (str, dict):
+    # Pool worker for the parse stage: reads and parses one class, then hands it to the consumer as the
+    # name of a shared memory block holding the packed class. Returns (block name, None) or (None, failure).
+    class_name, (kind, source) = task
+
+    try:
+        if kind == 'bytes':
+            class_bytes = source
+        elif kind == 'file':
+            with open(source, "rb") as f:
+                class_bytes = f.read()
+        else:
+            jar_path, entry = source
+            if jar_path not in worker_archives:
+                worker_archives[jar_path] = zipfile.ZipFile(jar_path)
+            class_bytes = worker_archives[jar_path].read(entry)
+
+        shm = share_class(ClassReader(class_bytes).read())
+    except Exception as e:
+        return None, failure('parse', e, class_name)
+
+    worker_blocks.append(shm)
+    return shm.name, None